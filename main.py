@@ -1,10 +1,26 @@
 import os
+import queue
+import logging
+import logging.handlers
 from pyrogram import Client, idle
 from pytgcalls import PyTgCalls
 from pytgcalls import idle as pyidle
 
 from config import API_ID,API_HASH,STRING_SESSION
 
+# logging configuration: handlers only enqueue records, a background thread writes them out
+# main.py is imported again by the plugins (as "main"), so only configure once
+logger = logging.getLogger("musicbot")
+log_listener = None
+if not logger.handlers:
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+    log_listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    log_listener.start()
+    logger.setLevel(logging.INFO)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+
 # pyrogram client configuration
 bot = Client("musicbot",
              api_id=API_ID,
@@ -16,8 +32,10 @@ bot = Client("musicbot",
 call_client = PyTgCalls(bot)
 
 bot.start()
-print("pyrogram client Started")
+logger.info("pyrogram client Started")
 call_client.start()
-print("pytgcalls Client Started")
+logger.info("pytgcalls Client Started")
 pyidle()
 idle()
+if log_listener:
+    log_listener.stop()  # Flush pending log records on shutdown
@@ -1,207 +1,334 @@
 import os
+import re
+import time
+import logging
 import asyncio
-from collections import deque
-from asyncio import Lock
+from uuid import uuid4
+from collections import deque, Counter
 from pyrogram import Client, filters
 from pyrogram.types import Message
+from pyrogram.enums import ChatMemberStatus
 from pytgcalls.types import MediaStream
 from pytgcalls.types import StreamAudioEnded
 from pytgcalls import PyTgCalls, filters as calls_filters, idle
-from config import MAX_QUEUE_SIZE, restrict_multiple_chats
+import config
+from config import MAX_QUEUE_SIZE
 from main import bot, call_client
 from .yt import YouTubeAPI
 
+logger = logging.getLogger("musicbot")
+
+TRASH_DIR = ".trash"  # Locked files are renamed here so their names are freed immediately
+TRASH_SWEEP_DELAY = 5  # Seconds before retrying deletion of locked files
+VALID_CHAT_TTL = 60  # Seconds to trust a successful get_chat lookup
+INVALID_CHAT_TTL = 600  # Seconds to remember an invalid peer before asking Telegram again
+MAX_PARALLEL_DOWNLOADS = 4  # yt-dlp runs beyond this mostly fight over bandwidth/CPU
+ADMIN_CACHE_TTL = 60  # Seconds to trust a cached admin check
+ADMIN_CACHE_MAX_SIZE = 1024  # Oldest entries are dropped beyond this
+_SHORTEN_RE = re.compile(r"[#|\-,.]")  # Earliest delimiter ends the display name
+
+_background_tasks = set()  # Strong refs so fire-and-forget tasks aren't garbage collected
+
+class _Flags:
+    """Runtime-togglable settings, seeded from config"""
+    restrict_multiple_chats = config.restrict_multiple_chats
+
+
+# Helper to run a coroutine in the background while holding a reference to its task
+def _spawn(coro):
+    """Create a task and keep it alive until it finishes"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
 
 # Helper function to shorten song name
 def shorten_song_name(songname: str) -> str:
     """Remove hashtags, pipes, dashes, and extra keywords from song name"""
-    short_name = songname.split('#')[0].split('|')[0].split('-')[0].split(',')[0].split('.')[0].strip()
-    return short_name
+    match = _SHORTEN_RE.search(songname)
+    return (songname[:match.start()] if match else songname).strip()
+
+class QueueEntry:
+    """Single queued song, slotted to keep per-entry overhead low"""
+    __slots__ = ("songname", "file_path", "url", "media_type", "quality", "requester", "user_id", "vidid", "duration")
+
+    def set(self, songname: str, file_path: str, url: str, media_type: str, quality: int, requester: str, user_id: int, vidid: str, duration: str):
+        self.songname = songname
+        self.file_path = file_path
+        self.url = url
+        self.media_type = media_type
+        self.quality = quality
+        self.requester = requester
+        self.user_id = user_id
+        self.vidid = vidid
+        self.duration = duration
+        return self
+
+class ChatState:
+    """Per-chat queue state kept together so each operation needs one dict lookup"""
+    __slots__ = ("queue", "user_counts")
+
+    def __init__(self, max_size: int):
+        self.queue = deque(maxlen=max_size)  # Set limit with maxlen
+        self.user_counts = Counter()  # {user_id: queued_songs}
 
 class MusicQueue:
-    """Efficient music queue management using deque and locks with limit"""
+    """Efficient music queue management using deque with limit (single event loop, no locks needed)"""
 
-    def __init__(self):
-        self.queues = {}  # {chat_id: deque()}
-        self.locks = {}  # {chat_id: Lock()}
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.chats = {}  # {chat_id: ChatState}
         self.file_usage = {}  # {file_path: usage_count}
-
-    async def add(self, chat_id: int, songname: str, file_path: str, url: str, media_type: str, quality: int, requester: str, user_id: int):
-        """Add song to queue with size limit, requester, and user_id"""
-        if chat_id not in self.queues:
-            self.queues[chat_id] = deque(maxlen=self.MAX_QUEUE_SIZE)  # Set limit with maxlen
-            self.locks[chat_id] = Lock()
-        async with self.locks[chat_id]:
-            if len(self.queues[chat_id]) >= self.MAX_QUEUE_SIZE:
-                return -1  # Queue full
-            self.queues[chat_id].append((songname, file_path, url, media_type, quality, requester, user_id))
-            self.file_usage[file_path] = self.file_usage.get(file_path, 0) + 1
-            return len(self.queues[chat_id])
-
-    async def pop(self, chat_id: int) -> tuple:
-        """Pop first song from queue"""
-        if chat_id in self.queues:
-            async with self.locks[chat_id]:
-                if self.queues[chat_id]:
-                    song = self.queues[chat_id].popleft()
-                    self.file_usage[song[1]] -= 1
-                    return song
-        return None
-
-    async def get_next(self, chat_id: int) -> tuple:
+        self._pool = []  # Released QueueEntry objects ready for reuse
+        self.streams = {}  # {file_path: MediaStream} reused until the file is deleted
+        os.makedirs(TRASH_DIR, exist_ok=True)
+        self.sweep_trash()  # Clear leftovers from a previous run
+
+    async def add(self, chat_id: int, songname: str, file_path: str, url: str, media_type: str, quality: int, requester: str, user_id: int, vidid: str = None, duration: str = None):
+        """Add song to queue with size limit, requester, user_id and track metadata"""
+        state = self.chats.get(chat_id)
+        if state is None:
+            state = self.chats[chat_id] = ChatState(self.max_size)
+        if len(state.queue) >= self.max_size:
+            return -1  # Queue full
+        entry = self._pool.pop() if self._pool else QueueEntry()
+        state.queue.append(entry.set(songname, file_path, url, media_type, quality, requester, user_id, vidid, duration))
+        self.file_usage[file_path] = self.file_usage.get(file_path, 0) + 1
+        state.user_counts[user_id] += 1
+        return len(state.queue)
+
+    async def pop(self, chat_id: int) -> QueueEntry:
+        """Pop first song from queue, caller should release() it once done"""
+        state = self.chats.get(chat_id)
+        if state is None or not state.queue:
+            return None
+        song = state.queue.popleft()
+        self.file_usage[song.file_path] -= 1
+        state.user_counts[song.user_id] -= 1
+        return song
+
+    def release(self, entry: QueueEntry):
+        """Return a popped entry to the pool for reuse by add()"""
+        if len(self._pool) < self.max_size:
+            entry.set(None, None, None, None, 0, None, None, None, None)  # Drop references
+            self._pool.append(entry)
+
+    def get_stream(self, file_path: str) -> MediaStream:
+        """Return the cached MediaStream for a file, building it on first use"""
+        stream = self.streams.get(file_path)
+        if stream is None:
+            stream = self.streams[file_path] = MediaStream(file_path)
+        return stream
+
+    async def get_next(self, chat_id: int) -> QueueEntry:
         """Get next song without removing it"""
-        if chat_id in self.queues:
-            async with self.locks[chat_id]:
-                return self.queues[chat_id][0] if self.queues[chat_id] else None
-        return None
-
-    async def get_queue(self, chat_id: int) -> list:
-        """Get the entire queue for a specific chat"""
-        if chat_id in self.queues:
-            async with self.locks[chat_id]:
-                return list(self.queues[chat_id])  # Convert deque to list for easy access
-        return []
+        state = self.chats.get(chat_id)
+        if state is None or not state.queue:
+            return None
+        return state.queue[0]
+
+    def queue_len(self, chat_id: int) -> int:
+        """Number of songs queued in a chat, without copying the queue"""
+        state = self.chats.get(chat_id)
+        return len(state.queue) if state else 0
+
+    def iter_queue(self, chat_id: int):
+        """Iterate queued songs in a chat without copying (do not await while iterating)"""
+        state = self.chats.get(chat_id)
+        return iter(state.queue if state else ())
 
     async def clear(self, chat_id: int):
         """Clear queue and update file usage"""
-        if chat_id in self.queues:
-            async with self.locks[chat_id]:
-                for _, file_path, _, _, _, _, _ in self.queues[chat_id]:
-                    self.file_usage[file_path] -= 1
-                self.queues[chat_id].clear()
-                del self.queues[chat_id]
-                del self.locks[chat_id]
-
-    async def cleanup_file(self, file_path: str):
-        """Delete file if not in use with async retry mechanism"""
+        state = self.chats.pop(chat_id, None)
+        if state is not None:
+            for song in state.queue:
+                self.file_usage[song.file_path] -= 1
+                if self.file_usage[song.file_path] <= 0:
+                    self.streams.pop(song.file_path, None)  # No queue references the file anymore
+            state.queue.clear()
+
+    def user_song_count(self, chat_id: int, user_id: int) -> int:
+        """Number of songs the user still has queued in the chat"""
+        state = self.chats.get(chat_id)
+        return state.user_counts[user_id] if state else 0
+
+    async def cleanup_file(self, file_path: str, deferred: bool = False):
+        """Delete file if not in use, moving locked files to trash instead of retrying in-band"""
         if file_path in self.file_usage and self.file_usage[file_path] <= 0:
-            max_retries = 5
-            retry_delay = 0.5  # Reduced to 0.5 seconds
-            for attempt in range(max_retries):
-                try:
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
-                        del self.file_usage[file_path]
-                        print(f"Deleted file: {file_path}")
-                    break
-                except PermissionError as e:
-                    if "[WinError 32]" in str(e):
-                        print(f"File {file_path} in use, retrying in {retry_delay} seconds... (Attempt {attempt + 1}/{max_retries})")
-                        await asyncio.sleep(retry_delay)  # Async delay
-                    else:
-                        print(f"Error deleting file {file_path}: {e}")
-                        break
-                except Exception as e:
-                    print(f"Error deleting file {file_path}: {e}")
-                    break
+            try:
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+                    logger.info("Deleted file: %s", file_path)
+                del self.file_usage[file_path]
+                self.streams.pop(file_path, None)
+            except PermissionError:
+                self.move_to_trash(file_path, deferred)  # e.g. [WinError 32], FFmpeg still holds the file
+            except Exception as e:
+                logger.error("Error deleting file %s: %s", file_path, e)
+
+    def move_to_trash(self, file_path: str, deferred: bool = False):
+        """Rename a locked file into the trash dir to free its name, then try deleting it"""
+        loop = asyncio.get_running_loop()
+        trash_path = os.path.join(TRASH_DIR, uuid4().hex)
+        try:
+            os.replace(file_path, trash_path)
+            del self.file_usage[file_path]
+            self.streams.pop(file_path, None)
+        except OSError as e:
+            if deferred:
+                logger.error("Failed to delete file %s: %s, skipping.", file_path, e)
             else:
-                print(f"Failed to delete file {file_path} after {max_retries} attempts, skipping.")
+                logger.warning("File %s in use, retrying in %s seconds...", file_path, TRASH_SWEEP_DELAY)
+                loop.call_later(TRASH_SWEEP_DELAY, lambda: _spawn(self.cleanup_file(file_path, deferred=True)))
+            return
+        try:
+            os.remove(trash_path)
+            logger.info("Deleted file: %s", file_path)
+        except OSError:
+            logger.warning("File %s moved to trash, sweeping in %s seconds...", file_path, TRASH_SWEEP_DELAY)
+            loop.call_later(TRASH_SWEEP_DELAY, self.sweep_trash)
+
+    def sweep_trash(self):
+        """Best-effort removal of everything left in the trash dir"""
+        for name in os.listdir(TRASH_DIR):
+            try:
+                os.remove(os.path.join(TRASH_DIR, name))
+            except OSError as e:
+                logger.error("Error deleting trashed file %s: %s", name, e)
+
+    async def discard_unqueued(self, file_path: str):
+        """Delete a downloaded file that never made it into a queue, unless another entry uses it"""
+        self.file_usage.setdefault(file_path, 0)
+        await self.cleanup_file(file_path)
 
     async def background_cleanup(self, file_path: str):
         """Background task to cleanup file"""
-        asyncio.create_task(self.cleanup_file(file_path))  # Run cleanup in background
+        _spawn(self.cleanup_file(file_path))  # Run cleanup in background
 
 # Music Player Class
 class MusicPlayer:
     """Main music player class"""
     def __init__(self):
-        self.queue_manager = MusicQueue()
+        self.queue_manager = MusicQueue(MAX_QUEUE_SIZE)
         self.youtube = YouTubeAPI()
         self.active_players = set()
         self.user_active_chats = {}  # {user_id: set(chat_ids)} to track all chats where user has songs
+        self.chat_to_users = {}  # {chat_id: set(user_ids)} reverse index of user_active_chats
+        self._valid_chat_cache = {}  # {chat_id: (is_valid, checked_at)}
+        self._download_sem = asyncio.Semaphore(MAX_PARALLEL_DOWNLOADS)
+
+    def _link_user_chat(self, user_id: int, chat_id: int):
+        """Record that user has songs in chat, keeping both indexes in sync"""
+        self.user_active_chats.setdefault(user_id, set()).add(chat_id)
+        self.chat_to_users.setdefault(chat_id, set()).add(user_id)
+
+    def _unlink_user_chat(self, user_id: int, chat_id: int):
+        """Forget that user has songs in chat, dropping emptied entries"""
+        chats = self.user_active_chats.get(user_id)
+        if chats is not None:
+            chats.discard(chat_id)
+            if not chats:
+                self.user_active_chats.pop(user_id, None)
+        users = self.chat_to_users.get(chat_id)
+        if users is not None:
+            users.discard(user_id)
 
     async def is_valid_chat(self, chat_id: int) -> bool:
-        """Check if the chat ID is valid"""
+        """Check if the chat ID is valid, caching the result for a short TTL"""
+        now = time.monotonic()
+        cached = self._valid_chat_cache.get(chat_id)
+        if cached:
+            valid, checked_at = cached
+            if now - checked_at < (VALID_CHAT_TTL if valid else INVALID_CHAT_TTL):
+                return valid
         try:
             await bot.get_chat(chat_id)
+            self._valid_chat_cache[chat_id] = (True, now)
             return True
         except ValueError as e:
             if "Peer id invalid" in str(e):
-                print(f"Invalid peer ID detected: {chat_id}")
+                logger.warning("Invalid peer ID detected: %s", chat_id)
+                self._valid_chat_cache[chat_id] = (False, now)
                 return False
             raise e
 
-    async def play_song(self, chat_id: int, file_path: str, url: str, media_type: str):
-        """Play song with optimized stream handling"""
-        if not await self.is_valid_chat(chat_id):
-            print(f"Skipping playback for invalid chat: {chat_id}")
+    async def play_song(self, chat_id: int, file_path: str, url: str, media_type: str, validated: bool = False):
+        """Play song with optimized stream handling, validated=True skips the chat check"""
+        if not validated and not await self.is_valid_chat(chat_id):
+            logger.warning("Skipping playback for invalid chat: %s", chat_id)
             return False
         try:
-            if chat_id not in self.active_players:
-                await call_client.play(chat_id, MediaStream(file_path))
-                self.active_players.add(chat_id)
-            else:
-                await call_client.play(chat_id, MediaStream(file_path))
+            stream = self.queue_manager.get_stream(file_path)
+            await call_client.play(chat_id, stream)
+            self.active_players.add(chat_id)  # No-op if already active
             return True
         except ValueError as e:
             if "Peer id invalid" in str(e):
-                print(f"Invalid peer ID {chat_id}, skipping playback.")
+                logger.warning("Invalid peer ID %s, skipping playback.", chat_id)
                 return False
-            print(f"Error playing song: {e}")
+            logger.error("Error playing song: %s", e)
             return False
         except Exception as e:
-            print(f"Unexpected error playing song: {e}")
+            logger.exception("Unexpected error playing song: %s", e)
             return False
 
-    async def end_call(self, chat_id: int):
-        """End call and cleanup"""
+    async def end_call(self, chat_id: int, validated: bool = False):
+        """End call and cleanup, validated=True skips the chat check"""
         if chat_id in self.active_players:
             try:
                 await call_client.leave_call(chat_id)
-                self.active_players.remove(chat_id)
+                self.active_players.discard(chat_id)
                 # Remove all users associated with this chat
-                for user_id in list(self.user_active_chats.keys()):
-                    if chat_id in self.user_active_chats[user_id]:
-                        self.user_active_chats[user_id].discard(chat_id)
-                        if not self.user_active_chats[user_id]:
-                            del self.user_active_chats[user_id]
+                for user_id in self.chat_to_users.pop(chat_id, ()):
+                    self._unlink_user_chat(user_id, chat_id)
                 await self.queue_manager.clear(chat_id)
-                if await self.is_valid_chat(chat_id):
+                if validated or await self.is_valid_chat(chat_id):
                     await bot.send_message(chat_id, "Voice Chat Ended...")
+                self._valid_chat_cache.pop(chat_id, None)  # Revalidate on next session
             except ValueError as e:
                 if "Peer id invalid" in str(e):
-                    print(f"Invalid peer ID {chat_id}, cleaning up locally.")
-                    self.active_players.remove(chat_id)
+                    logger.warning("Invalid peer ID %s, cleaning up locally.", chat_id)
+                    self.active_players.discard(chat_id)
                     await self.queue_manager.clear(chat_id)
+                    self._valid_chat_cache.pop(chat_id, None)
                 else:
-                    print(f"Error ending call: {e}")
+                    logger.error("Error ending call: %s", e)
             except Exception as e:
-                print(f"Unexpected error ending call: {e}")
+                logger.exception("Unexpected error ending call: %s", e)
 
-    async def skip_current(self, chat_id: int):
-        """Skip current song and play next"""
-        if not await self.is_valid_chat(chat_id):
-            print(f"Skipping skip operation for invalid chat: {chat_id}")
+    async def skip_current(self, chat_id: int, validated: bool = False):
+        """Skip current song and play next, validated=True skips the chat check"""
+        if not validated and not await self.is_valid_chat(chat_id):
+            logger.warning("Skipping skip operation for invalid chat: %s", chat_id)
             return None
 
         current_song = await self.queue_manager.pop(chat_id)
         if not current_song:
-            await self.end_call(chat_id)
+            await self.end_call(chat_id, validated=True)
             return None
 
         # Cleanup in background to avoid delay
-        await self.queue_manager.background_cleanup(current_song[1])
+        await self.queue_manager.background_cleanup(current_song.file_path)
 
         # Remove user from active chats if no more songs in queue
-        user_id = current_song[6]  # User ID
-        if user_id in self.user_active_chats:
-            queue = await self.queue_manager.get_queue(chat_id)
-            if not any(song[6] == user_id for song in queue):  # If no songs from this user remain in queue
-                self.user_active_chats[user_id].discard(chat_id)
-                if not self.user_active_chats[user_id]:
-                    del self.user_active_chats[user_id]
+        user_id = current_song.user_id
+        self.queue_manager.release(current_song)
+        if self.queue_manager.user_song_count(chat_id, user_id) == 0:  # If no songs from this user remain in queue
+            self._unlink_user_chat(user_id, chat_id)
 
         next_song = await self.queue_manager.get_next(chat_id)
         if not next_song:
-            await self.end_call(chat_id)
+            await self.end_call(chat_id, validated=True)
             return 0
 
-        success = await self.play_song(chat_id, next_song[1], next_song[2], next_song[3])
+        # Snapshot before awaiting: a concurrent skip may pop and release() this entry
+        now_playing = [next_song.songname, next_song.url, next_song.requester, next_song.vidid, next_song.duration]
+        success = await self.play_song(chat_id, next_song.file_path, next_song.url, next_song.media_type, validated=True)
         if not success:
-            await self.end_call(chat_id)
+            await self.end_call(chat_id, validated=True)
             return 2
 
-        return [next_song[0], next_song[2], next_song[5]]  # songname, url, requester
+        return now_playing
 
     async def pause(self, chat_id: int) -> bool:
         """Pause the current stream in the chat"""
@@ -211,7 +338,7 @@ class MusicPlayer:
             await call_client.pause(chat_id)
             return True
         except Exception as e:
-            print(f"Error pausing stream in chat {chat_id}: {e}")
+            logger.error("Error pausing stream in chat %s: %s", chat_id, e)
             return False
 
     async def resume(self, chat_id: int) -> bool:
@@ -222,66 +349,94 @@ class MusicPlayer:
             await call_client.resume(chat_id)
             return True
         except Exception as e:
-            print(f"Error resuming stream in chat {chat_id}: {e}")
+            logger.error("Error resuming stream in chat %s: %s", chat_id, e)
             return False
 
 # Initialize Player
 player = MusicPlayer()
 
+# Helper to run a notification without blocking playback on Telegram's RTT
+def _notify(coro):
+    """Schedule a Telegram send in the background, logging instead of raising"""
+    async def _safe():
+        try:
+            await coro
+        except Exception as e:
+            logger.error("Error sending notification: %s", e)
+    _spawn(_safe())
+
+# Helper function to send now playing card, falling back to text
+async def send_now_playing(chat_id: int, thumbnail: str, caption: str):
+    """Send thumbnail with caption, or plain message if the photo fails"""
+    try:
+        await bot.send_photo(
+            chat_id=chat_id,
+            photo=thumbnail,
+            caption=caption,
+            disable_notification=True
+        )
+    except Exception as e:
+        logger.error("Error sending photo: %s", e)
+        await bot.send_message(
+            chat_id=chat_id,
+            text=caption,
+            disable_web_page_preview=False,
+            disable_notification=True
+        )
+
+_admin_cache = {}  # {(chat_id, user_id): (is_admin, checked_at)}
+
 # Helper function to check if user is admin
 async def is_admin(chat_id: int, user_id: int) -> bool:
-    """Check if the user is an admin in the chat"""
+    """Check if the user is an admin in the chat, caching the result for a short TTL"""
+    key = (chat_id, user_id)
+    now = time.monotonic()
+    cached = _admin_cache.get(key)
+    if cached:
+        if now - cached[1] < ADMIN_CACHE_TTL:
+            return cached[0]
+        del _admin_cache[key]  # Expired
     try:
         member = await bot.get_chat_member(chat_id, user_id)
-        return member.status in ["administrator", "creator"]
+        status = member.status in (ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER)
+        while len(_admin_cache) >= ADMIN_CACHE_MAX_SIZE:
+            del _admin_cache[next(iter(_admin_cache))]  # Insertion order, so this is the oldest
+        _admin_cache[key] = (status, now)
+        return status
     except Exception as e:
-        print(f"Error checking admin status: {e}")
+        logger.error("Error checking admin status: %s", e)
         return False
 
 # Stream End Handler (Auto Play)
 @call_client.on_update(calls_filters.stream_end)
 async def stream_end_handler(_: PyTgCalls, update: StreamAudioEnded):
     chat_id = update.chat_id
-    result = await player.skip_current(chat_id)
+    # Validate once up front, everything below runs against the same chat
+    if not await player.is_valid_chat(chat_id):
+        logger.warning("Skipping auto play for invalid chat: %s", chat_id)
+        return
+    result = await player.skip_current(chat_id, validated=True)
 
     if result == 0:
-        if await player.is_valid_chat(chat_id):
-            await bot.send_message(chat_id, "Queue is empty, leaving voice chat...")
+        await bot.send_message(chat_id, "Queue is empty, leaving voice chat...")
     elif result == 2:
-        if await player.is_valid_chat(chat_id):
-            await bot.send_message(chat_id, "An error occurred, leaving voice chat...")
+        await bot.send_message(chat_id, "An error occurred, leaving voice chat...")
     elif result:
-        if await player.is_valid_chat(chat_id):
-            songname, url, requester = result  # Changed to unpack 3 values
-            if url:
-                track_details, vidid = await player.youtube.track(url)
-                thumbnail = f"https://i.ytimg.com/vi/{vidid}/hqdefault.jpg"
-                duration = track_details["duration_min"]
-            else:
-                thumbnail = "https://i.ytimg.com/vi/default.jpg"
-                duration = "??"
-            short_songname = shorten_song_name(songname)
-            caption = (
-                f"⏰ Vibe Time: {duration}\n"
-                f"🎶 Vibe: [{short_songname}]({url})\n"
-                f"👤 Proposed by: {requester}\n"
-                f"👤 Auto Played"
-            )
-            try:
-                await bot.send_photo(
-                    chat_id=chat_id,
-                    photo=thumbnail,
-                    caption=caption,
-                    disable_notification=True
-                )
-            except Exception as e:
-                print(f"Error sending photo: {e}")
-                await bot.send_message(
-                    chat_id=chat_id,
-                    text=caption,
-                    disable_web_page_preview=False,
-                    disable_notification=True
-                )
+        songname, url, requester, vidid, duration = result  # Track metadata captured at enqueue time
+        if vidid:
+            thumbnail = f"https://i.ytimg.com/vi/{vidid}/hqdefault.jpg"
+            duration = duration or "??"
+        else:
+            thumbnail = "https://i.ytimg.com/vi/default.jpg"
+            duration = "??"
+        short_songname = shorten_song_name(songname)
+        caption = (
+            f"⏰ Vibe Time: {duration}\n"
+            f"🎶 Vibe: [{short_songname}]({url})\n"
+            f"👤 Proposed by: {requester}\n"
+            f"👤 Auto Played"
+        )
+        _notify(send_now_playing(chat_id, thumbnail, caption))
 
 # Play Command Handler
 @Client.on_message(filters.command(['play']))
@@ -296,14 +451,14 @@ async def play_command(_, m: Message):
         sender = await m.reply("`Processing...`")
     except ValueError as e:
         if "Peer id invalid" in str(e):
-            print(f"Cannot send message to invalid peer {chat_id}")
+            logger.warning("Cannot send message to invalid peer %s", chat_id)
             return
         await m.reply("Invalid chat, try again!")
         return
 
     # Check if user has any active songs (playing or queued) in any chat
     # Only apply restriction if restrict_multiple_chats is True
-    if (restrict_multiple_chats and 
+    if (_Flags.restrict_multiple_chats and 
         user_id in player.user_active_chats and 
         player.user_active_chats[user_id]):
         active_chats = ", ".join(str(cid) for cid in player.user_active_chats[user_id])
@@ -311,8 +466,7 @@ async def play_command(_, m: Message):
         return
 
     # Check queue limit first
-    queue = await player.queue_manager.get_queue(chat_id)
-    if len(queue) >= MAX_QUEUE_SIZE:
+    if player.queue_manager.queue_len(chat_id) >= MAX_QUEUE_SIZE:
         await sender.edit(f"Queue is full (max {MAX_QUEUE_SIZE} songs)! Skip older songs first.")
         return
 
@@ -323,6 +477,10 @@ async def play_command(_, m: Message):
             url = None
 
             pos = await player.queue_manager.add(chat_id, songname, dl, url, "Audio", 0, requester, user_id)
+            if pos == -1:  # Filled up while we were downloading
+                await sender.edit(f"Queue is full (max {MAX_QUEUE_SIZE} songs)! Skip older songs first.")
+                await player.queue_manager.discard_unqueued(dl)
+                return
             if pos == 1:
                 if await player.play_song(chat_id, dl, url, "Audio"):
                     short_songname = shorten_song_name(songname)
@@ -333,9 +491,7 @@ async def play_command(_, m: Message):
                     )
                     # Add user to active chats
                     if user_id:
-                        if user_id not in player.user_active_chats:
-                            player.user_active_chats[user_id] = set()
-                        player.user_active_chats[user_id].add(chat_id)
+                        player._link_user_chat(user_id, chat_id)
                     await sender.edit(caption)
                 else:
                     await sender.edit("**Error ⚠️**\n`Playback failed to start, try again!`")
@@ -343,9 +499,7 @@ async def play_command(_, m: Message):
                 short_songname = shorten_song_name(songname)
                 # Add user to active chats even for queued songs
                 if user_id:
-                    if user_id not in player.user_active_chats:
-                        player.user_active_chats[user_id] = set()
-                    player.user_active_chats[user_id].add(chat_id)
+                    player._link_user_chat(user_id, chat_id)
                 await sender.edit(
                     f"**Queued at #{pos}**\n"
                     f"🎶 Vibe: [{short_songname}]({url})\n"
@@ -353,14 +507,19 @@ async def play_command(_, m: Message):
                 )
         except Exception as e:
             await sender.edit(f"**Error ⚠️**\n`Error processing audio: {str(e)}`")
-            print(f"Error in replied audio: {e}")
+            logger.error("Error in replied audio: %s", e)
 
     elif len(m.command) < 2:
         await sender.edit("Reply with an audio file or provide a search query!")
     else:
         query = m.text.split(None, 1)[1]
         try:
-            search = await player.youtube.track(query)
+            # Overlap the status update with the search request, a failed edit must not fail /play
+            edited, search = await asyncio.gather(sender.edit("`Searching...`"), player.youtube.track(query), return_exceptions=True)
+            if isinstance(edited, Exception):
+                logger.warning("Error updating status message: %s", edited)
+            if isinstance(search, Exception):
+                raise search
             if not search:
                 await sender.edit("No results found!")
                 return
@@ -371,12 +530,17 @@ async def play_command(_, m: Message):
             thumbnail = f"https://i.ytimg.com/vi/{vidid}/hqdefault.jpg"
             duration = track_details.get("duration_min", "??")
 
-            audio_file, _ = await player.youtube.download(url)
+            async with player._download_sem:
+                audio_file, _ = await player.youtube.download(url)
             if not audio_file:
                 await sender.edit("**Download Error ⚠️**\n`Song download failed!`")
                 return
 
-            pos = await player.queue_manager.add(chat_id, songname, audio_file, url, "Audio", 0, requester, user_id)
+            pos = await player.queue_manager.add(chat_id, songname, audio_file, url, "Audio", 0, requester, user_id, vidid, duration)
+            if pos == -1:  # Filled up while we were downloading
+                await sender.edit(f"Queue is full (max {MAX_QUEUE_SIZE} songs)! Skip older songs first.")
+                await player.queue_manager.discard_unqueued(audio_file)
+                return
             if pos == 1:
                 if await player.play_song(chat_id, audio_file, url, "Audio"):
                     short_songname = shorten_song_name(songname)
@@ -387,34 +551,16 @@ async def play_command(_, m: Message):
                     )
                     # Add user to active chats
                     if user_id:
-                        if user_id not in player.user_active_chats:
-                            player.user_active_chats[user_id] = set()
-                        player.user_active_chats[user_id].add(chat_id)
+                        player._link_user_chat(user_id, chat_id)
                     await sender.delete()
-                    try:
-                        await bot.send_photo(
-                            chat_id=chat_id,
-                            photo=thumbnail,
-                            caption=caption,
-                            disable_notification=True
-                        )
-                    except Exception as e:
-                        print(f"Error sending photo: {e}")
-                        await bot.send_message(
-                            chat_id=chat_id,
-                            text=caption,
-                            disable_web_page_preview=False,
-                            disable_notification=True
-                        )
+                    _notify(send_now_playing(chat_id, thumbnail, caption))
                 else:
                     await sender.edit("**Error ⚠️**\n`Playback failed to start, try again!`")
             else:
                 short_songname = shorten_song_name(songname)
                 # Add user to active chats even for queued songs
                 if user_id:
-                    if user_id not in player.user_active_chats:
-                        player.user_active_chats[user_id] = set()
-                    player.user_active_chats[user_id].add(chat_id)
+                    player._link_user_chat(user_id, chat_id)
                 await sender.edit(
                     f"**Queued at #{pos}**\n"
                     f"🎶 Vibe: [{short_songname}]({url})\n"
@@ -422,7 +568,7 @@ async def play_command(_, m: Message):
                 )
         except Exception as e:
             await sender.edit(f"**Error ⚠️**\n`Error processing query: {str(e)}`")
-            print(f"Error in query: {e}")
+            logger.error("Error in query: %s", e)
 
 # Skip Command Handler
 @Client.on_message(filters.command(['skip']))
@@ -437,13 +583,11 @@ async def skip_command(_, m: Message):
     elif result == 2:
         await m.reply("An error occurred, ending voice chat...")
     elif result:
-        songname, url, requester = result  # Extract only songname, url, requester
-        queue = await player.queue_manager.get_queue(chat_id)  # Get current queue
-        total_songs = len(queue)  # Total songs remaining in queue
-        if url:
-            track_details, vidid = await player.youtube.track(url)
+        songname, url, requester, vidid, duration = result  # Track metadata captured at enqueue time
+        total_songs = player.queue_manager.queue_len(chat_id)  # Total songs remaining in queue
+        if vidid:
             thumbnail = f"https://i.ytimg.com/vi/{vidid}/hqdefault.jpg"
-            duration = track_details["duration_min"]
+            duration = duration or "----"
         else:
             thumbnail = "https://i.ytimg.com/vi/default.jpg"
             duration = "----"
@@ -454,21 +598,7 @@ async def skip_command(_, m: Message):
             f"👤 Skipped by: {skipper}\n"
             f"Total Songs in Queue: {total_songs}"  # Total songs outside quotes
         )
-        try:
-            await bot.send_photo(
-                chat_id=chat_id,
-                photo=thumbnail,
-                caption=caption,
-                disable_notification=True
-            )
-        except Exception as e:
-            print(f"Error sending photo: {e}")
-            await bot.send_message(
-                chat_id=chat_id,
-                text=caption,
-                disable_web_page_preview=False,
-                disable_notification=True
-            )
+        _notify(send_now_playing(chat_id, thumbnail, caption))
 
 # Queue Command Handler
 @Client.on_message(filters.command(['queue']))
@@ -479,18 +609,16 @@ async def queue_command(_, m: Message):
         await m.reply("Cannot access this chat!")
         return
 
-    queue = await player.queue_manager.get_queue(chat_id)
-
-    if not queue:
+    if not player.queue_manager.queue_len(chat_id):
         await m.reply("Queue is empty!")
         return
 
-    queue_text = "Current Queue:\n"
-    for i, (songname, _, url, _, _, requester, _) in enumerate(queue, 1):
-        short_songname = shorten_song_name(songname)
-        queue_text += f"{i}. `\"{short_songname}\" proposed by \"{requester}\"` - [Link]({url})\n"
+    parts = ["Current Queue:\n"]
+    for i, song in enumerate(player.queue_manager.iter_queue(chat_id), 1):
+        short_songname = shorten_song_name(song.songname)
+        parts.append(f"{i}. `\"{short_songname}\" proposed by \"{song.requester}\"` - [Link]({song.url})\n")
 
-    await m.reply(queue_text, disable_web_page_preview=True)
+    await m.reply("".join(parts), disable_web_page_preview=True)
 
 # Pause Command Handler (Admin Only)
 @Client.on_message(filters.command(['pause']))
@@ -578,7 +706,6 @@ async def end_command(_, m: Message):
 @Client.on_message(filters.command(['togglemulti']))
 async def toggle_multi_command(_, m: Message):
     """Toggle multiple chat restriction"""
-    global restrict_multiple_chats  # Use global to modify the imported variable
-    restrict_multiple_chats = not restrict_multiple_chats
-    status = "enabled" if restrict_multiple_chats else "disabled"
+    _Flags.restrict_multiple_chats = not _Flags.restrict_multiple_chats
+    status = "enabled" if _Flags.restrict_multiple_chats else "disabled"
     await m.reply(f"Multiple chat restriction is now {status}")
\ No newline at end of file
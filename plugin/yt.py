@@ -1,4 +1,4 @@
-import os, re, json, asyncio
+import os, re, json, asyncio, logging
 from typing import Union
 from yt_dlp import YoutubeDL
 from py_yt import VideosSearch
@@ -6,6 +6,8 @@ from pyrogram import Client, filters
 from pyrogram.types import Message
 from pyrogram.enums import MessageEntityType
 
+logger = logging.getLogger("musicbot")
+
 def time_to_seconds(time):
     stringt = str(time)
     return sum(int(x) * 60**i for i, x in enumerate(reversed(stringt.split(":"))))
@@ -258,9 +260,9 @@ class YouTubeAPI:
                 x.download([link])
                 return xyz
             except Exception as e:
-                print(f"Download failed: {e}")
+                logger.error("Download failed: %s", e)
                 if fallback_format:
-                    print(f"Trying fallback format: {fallback_format}")
+                    logger.warning("Trying fallback format: %s", fallback_format)
                     ydl_opts["format"] = fallback_format
                     ydl_opts.pop("postprocessors", None)  # Remove postprocessors for fallback
                     try:
@@ -272,7 +274,7 @@ class YouTubeAPI:
                         x.download([link])
                         return xyz
                     except Exception as e:
-                        print(f"Fallback download failed: {e}")
+                        logger.error("Fallback download failed: %s", e)
                         return None
                 return None
 